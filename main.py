@@ -1,19 +1,31 @@
+import asyncio
 import os
 import json
+import functools
+import heapq
+import tempfile
+import threading
+import time
 import uuid
-from datetime import datetime, timedelta
+import zipfile
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import date, datetime, timedelta
 from io import BytesIO
 from typing import Any, Dict, List, Tuple, Optional
 
+import numpy as np
 import pandas as pd
 from fastapi import FastAPI, HTTPException, Query
 from fastapi.responses import JSONResponse
 from google.oauth2 import service_account
 from googleapiclient.discovery import build
-from googleapiclient.http import MediaIoBaseDownload
 from zoneinfo import ZoneInfo
 
 from openpyxl import load_workbook
+from openpyxl.cell.cell import Cell
+from openpyxl.writer.excel import ExcelWriter
+from python_calamine import CalamineWorkbook
 
 import smtplib
 from email.message import EmailMessage
@@ -30,11 +42,30 @@ app = FastAPI()
 # 簡易ロック＆簡易台帳（練習用：プロセス内メモリ）
 # ※本番はDrive/DBなど永続化へ
 # ----------------------------
-RUN_LOCK: Dict[str, datetime] = {}           # as_of_date -> lock acquired time
+RUN_LOCK: Dict[str, float] = {}              # as_of_date -> lock acquired time (time.monotonic)
+RUN_LOCK_EXPIRY: List[Tuple[float, str, float]] = []  # (expires_at, as_of_date, acquired) の min-heap
 RUN_SUCCESS: Dict[str, Dict[str, Any]] = {}  # as_of_date -> success record
 
 LOCK_TTL_SECONDS = 60 * 30  # 30分（保険）
 
+# Driveダウンロードの並列数（必須ファイル数以上あれば十分）
+DOWNLOAD_MAX_WORKERS = 8
+
+# テンプレの簡易キャッシュ（file_id -> (modifiedTime, bytes)）
+# ※プロセス再起動に備えて一時ディレクトリにも置いておく
+TEMPLATE_CACHE: Dict[str, Tuple[str, bytes]] = {}
+TEMPLATE_CACHE_DIR = os.path.join(tempfile.gettempdir(), "dify-callcenter-template")
+
+# 入力Dataの短期キャッシュ（(日次フォルダID, ファイルID/更新日時の組) -> (取得時刻, 指標別DataFrame)）
+# ※メール失敗などでの再実行時に、入力が変わっていなければダウンロード＋パースを省く
+INPUT_CACHE: Dict[Tuple[str, Tuple[Tuple[str, str, str], ...]], Tuple[float, Dict[str, pd.DataFrame]]] = {}
+INPUT_CACHE_TTL_SECONDS = 60 * 5
+INPUT_CACHE_MAX_ENTRIES = 4  # 日付ごとに7ファイル分のDataFrameを持つので、件数でも上限を付ける
+INPUT_CACHE_LOCK = threading.Lock()  # 別日付のジョブが並行して読み書きするので、INPUT_CACHE はこの中でだけ触る
+
+# 出力xlsxの deflate レベル（1: 既定の6よりサイズ2割増し程度で、圧縮時間は約1/3）
+OUTPUT_ZIP_COMPRESSLEVEL = 1
+
 # ----------------------------
 # 設定
 # ----------------------------
@@ -48,6 +79,9 @@ REQUIRED_FILES = [
     "稼働率.xlsx",
 ]
 
+# 必須ファイルだけを名前で絞り込む Drive の検索条件
+REQUIRED_FILES_QUERY = " or ".join(f"name = '{name}'" for name in REQUIRED_FILES)
+
 METRIC_BY_FILENAME = {
     "CPH.xlsx": "CPH",
     "AHT.xlsx": "AHT",
@@ -58,9 +92,18 @@ METRIC_BY_FILENAME = {
     "稼働率.xlsx": "稼働率",
 }
 
+# (ファイル名, 指標名) の組を REQUIRED_FILES の順で持っておく
+REQUIRED_ITEMS = tuple((filename, METRIC_BY_FILENAME[filename]) for filename in REQUIRED_FILES)
+
 # INPUT共通列（実データ前提）
 BASE_COLS = ["日付", "agent_id", "氏名", "勤務区分", "実働時間(h)", "CPD目標"]
 
+# agent_id として扱う列名の揺れ
+AGENT_ID_ALIASES = frozenset(["エージェントID", "エージェントId", "agent_id", "AgentID", "AGENT_ID", "ID"])
+
+# 数値化の前に落とす文字（%・カンマ・前後の空白）を1回の置換で処理する
+NUMERIC_NOISE_PATTERN = r"^\s+|\s+$|[%,]"
+
 # テンプレシート名（違うならここだけ変える）
 SHEET_FACT_DAILY = "Fact_Daily"
 SHEET_FACT_LONG = "Fact_Long"
@@ -77,78 +120,253 @@ def health():
 # ----------------------------
 # Drive（読み取り専用）
 # ----------------------------
-def _get_drive_service():
-    sa_json = os.environ.get("GCP_SA_JSON")
-    if not sa_json:
-        raise RuntimeError("Missing env: GCP_SA_JSON")
-
+@functools.lru_cache(maxsize=1)
+def _load_drive_credentials(sa_json: str):
+    # JSONパース＋秘密鍵の読み込みは鍵ごとに1回だけ（トークン更新は google-auth 側で自動）
     sa_info = json.loads(sa_json)
-    credentials = service_account.Credentials.from_service_account_info(
+    return service_account.Credentials.from_service_account_info(
         sa_info,
         scopes=["https://www.googleapis.com/auth/drive.readonly"],
     )
-    return build("drive", "v3", credentials=credentials, cache_discovery=False)
 
 
-def _find_child_folder_by_name(drive, parent_folder_id: str, folder_name: str) -> Optional[Dict[str, str]]:
+def _get_drive_credentials():
+    sa_json = os.environ.get("GCP_SA_JSON")
+    if not sa_json:
+        raise RuntimeError("Missing env: GCP_SA_JSON")
+    return _load_drive_credentials(sa_json)
+
+
+# build() は認証情報の生成＋ディスカバリ文書のパースで重いので、スレッドごとに使い回す
+# （httplib2 はスレッドセーフではないため、スレッド間では共有しない）
+_DRIVE_LOCAL = threading.local()
+
+
+def _get_drive_service():
+    sa_json = os.environ.get("GCP_SA_JSON")
+    cached = getattr(_DRIVE_LOCAL, "entry", None)
+    if cached is not None and cached[0] == sa_json:
+        return cached[1]
+
+    credentials = _get_drive_credentials()
+    drive = build("drive", "v3", credentials=credentials, cache_discovery=False)
+    _DRIVE_LOCAL.entry = (sa_json, drive)
+    return drive
+
+
+def _find_child_folder_request(drive, parent_folder_id: str, folder_name: str):
     q = (
         f"'{parent_folder_id}' in parents and "
         f"mimeType = 'application/vnd.google-apps.folder' and "
         f"name = '{folder_name}' and trashed = false"
     )
-    res = drive.files().list(q=q, fields="files(id,name)", pageSize=10).execute()
-    files = res.get("files", [])
-    return files[0] if files else None
+    return drive.files().list(q=q, fields="files(id,name)", pageSize=10)
+
+
+def _execute_batch(drive, requests: Dict[str, Any]) -> Dict[str, Tuple[Any, Optional[Exception]]]:
+    # 互いに独立なメタデータ取得を1回のHTTP往復にまとめる（get_media は batch 不可）
+    results: Dict[str, Tuple[Any, Optional[Exception]]] = {}
+
+    def _callback(request_id, response, exception):
+        results[request_id] = (response, exception)
+
+    batch = drive.new_batch_http_request(callback=_callback)
+    for request_id, request in requests.items():
+        batch.add(request, request_id=request_id)
+    batch.execute()
+    return results
 
 
 def _list_child_files(drive, parent_folder_id: str, page_size: int = 200) -> List[Dict[str, Any]]:
     q = f"'{parent_folder_id}' in parents and trashed = false"
     res = drive.files().list(
         q=q,
-        fields="files(id,name,mimeType,modifiedTime)",
+        fields="files(id,name,mimeType)",
         pageSize=page_size,
         orderBy="name",
     ).execute()
     return res.get("files", [])
 
 
+def _list_required_files(drive, parent_folder_id: str) -> List[Dict[str, Any]]:
+    # フォルダ内を全件取らず、必須ファイル名だけを1回の検索で取る
+    q = (
+        f"'{parent_folder_id}' in parents and trashed = false and "
+        f"mimeType != 'application/vnd.google-apps.folder' and "
+        f"({REQUIRED_FILES_QUERY})"
+    )
+    res = drive.files().list(
+        q=q,
+        fields="files(id,name,modifiedTime)",
+        pageSize=len(REQUIRED_FILES) * 4,
+    ).execute()
+    return res.get("files", [])
+
+
 def _download_file_bytes(drive, file_id: str) -> bytes:
-    fh = BytesIO()
-    request = drive.files().get_media(fileId=file_id)
-    downloader = MediaIoBaseDownload(fh, request)
-    done = False
-    while not done:
-        _, done = downloader.next_chunk()
-    return fh.getvalue()
+    # 入力/テンプレはどれも数MB程度なので、分割ダウンロードせず1回のGETで本体を取る
+    return drive.files().get_media(fileId=file_id).execute()
+
+
+# ワーカースレッドを使い回す（スレッドごとの Drive service もリクエストをまたいで再利用される）
+_DOWNLOAD_POOL = ThreadPoolExecutor(max_workers=DOWNLOAD_MAX_WORKERS, thread_name_prefix="drive-download")
+
+
+def _load_input_frames_concurrently(file_id_by_name: Dict[str, str], sheet_name: str = "Data") -> Dict[str, pd.DataFrame]:
+    # ダウンロードは I/O 待ちが支配的＆互いに独立なので並列で取る
+    # 届いたものから同じワーカーでパースし、残りのダウンロード待ちと重ねる
+    def _fetch_and_read(file_id: str) -> pd.DataFrame:
+        return _read_excel_from_bytes(_download_file_bytes(_get_drive_service(), file_id), sheet_name=sheet_name)
+
+    futures = {_DOWNLOAD_POOL.submit(_fetch_and_read, fid): name for name, fid in file_id_by_name.items()}
+    return {futures[fut]: fut.result() for fut in as_completed(futures)}
+
+
+def _input_cache_key(daily_folder_id: str, files: List[Dict[str, Any]]):
+    # 更新日時が取れないファイルがあればキャッシュしない
+    if any(not f.get("modifiedTime") for f in files):
+        return None
+    return (daily_folder_id, tuple(sorted((f["name"], f["id"], f["modifiedTime"]) for f in files)))
+
+
+def _sweep_input_cache(now: float) -> None:
+    # ※INPUT_CACHE_LOCK を持った状態で呼ぶ
+    for k, (t, _) in list(INPUT_CACHE.items()):
+        if now - t > INPUT_CACHE_TTL_SECONDS:
+            INPUT_CACHE.pop(k, None)
+
+
+def _get_cached_input_frames(key) -> Optional[Dict[str, pd.DataFrame]]:
+    if key is None:
+        return None
+    with INPUT_CACHE_LOCK:
+        _sweep_input_cache(time.monotonic())
+        cached = INPUT_CACHE.get(key)
+    return cached[1] if cached else None
+
+
+def _put_cached_input_frames(key, raw_by_metric: Dict[str, pd.DataFrame]) -> None:
+    if key is None:
+        return
+    with INPUT_CACHE_LOCK:
+        now = time.monotonic()
+        _sweep_input_cache(now)
+        # 上限を超える分は古いものから捨てる
+        while len(INPUT_CACHE) >= INPUT_CACHE_MAX_ENTRIES:
+            oldest = min(INPUT_CACHE, key=lambda k: INPUT_CACHE[k][0])
+            INPUT_CACHE.pop(oldest, None)
+        INPUT_CACHE[key] = (now, raw_by_metric)
+
+
+def _drop_cached_input_frames(key) -> None:
+    if key is None:
+        return
+    with INPUT_CACHE_LOCK:
+        INPUT_CACHE.pop(key, None)
+
+
+def _get_template_bytes(drive, file_id: str, modified_time: Optional[str]) -> bytes:
+    # テンプレは滅多に変わらないので、modifiedTime が同じ間は再ダウンロードしない
+    if not modified_time:
+        return _download_file_bytes(drive, file_id)  # 更新日時が不明ならキャッシュしない
+
+    cached = TEMPLATE_CACHE.get(file_id)
+    if cached and cached[0] == modified_time:
+        return cached[1]
+
+    cache_path = os.path.join(TEMPLATE_CACHE_DIR, f"{file_id}_{modified_time.replace(':', '')}.xlsx")
+    try:
+        with open(cache_path, "rb") as f:
+            template_bytes = f.read()
+    except OSError:
+        template_bytes = _download_file_bytes(drive, file_id)
+        try:
+            os.makedirs(TEMPLATE_CACHE_DIR, exist_ok=True)
+            tmp_path = f"{cache_path}.{uuid.uuid4().hex}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(template_bytes)
+            os.replace(tmp_path, cache_path)
+        except OSError:
+            pass  # キャッシュに置けなくても処理は続ける
+
+    TEMPLATE_CACHE[file_id] = (modified_time, template_bytes)
+    return template_bytes
 
 
 # ----------------------------
 # Excel -> DataFrame（Phase2）
 # ----------------------------
+def _normalize_calamine_cell(v):
+    # openpyxl で読んだときと同じ値に揃える（空セル→None、整数のfloat→int、日付のみ→datetime）
+    t = type(v)
+    if t is str:
+        return v if v else None
+    if t is float:
+        return int(v) if v.is_integer() else v
+    if t is date:
+        return datetime(v.year, v.month, v.day)
+    return v
+
+
+def _used_width(row: List[Any]) -> int:
+    for i in range(len(row) - 1, -1, -1):
+        if row[i] is not None:
+            return i + 1
+    return 0
+
+
+def _dedup_column_names(names: List[Any]) -> List[Any]:
+    # pandas（read_excel）と同じく、重複した列名に .1, .2 ... を付ける（見出しに既にある名前は避ける）
+    existing = set(names)
+    counts: Dict[Any, int] = defaultdict(int)
+    deduped = []
+    for name in names:
+        col = name
+        cur = counts[name]
+        while cur > 0:
+            counts[name] = cur + 1
+            col = f"{name}.{cur}"
+            cur = cur + 1 if col in existing else counts[col]
+        deduped.append(col)
+        counts[col] = cur + 1
+    return deduped
+
+
 def _read_excel_from_bytes(xbytes: bytes, sheet_name: str = "Data") -> pd.DataFrame:
-    bio = BytesIO(xbytes)
+    # calamine（Rust実装）で値だけ読む（openpyxl の read_only よりさらに1桁速い）
+    wb = CalamineWorkbook.from_filelike(BytesIO(xbytes))
     try:
-        return pd.read_excel(bio, sheet_name=sheet_name)
-    except ValueError:
-        bio.seek(0)
-        return pd.read_excel(bio)  # fallback
+        # シート一覧はパース済みなので、例外に頼らず先に読む対象を決める
+        if sheet_name in wb.sheet_names:
+            ws = wb.get_sheet_by_name(sheet_name)
+        else:
+            ws = wb.get_sheet_by_index(0)  # fallback
+
+        rows = [[_normalize_calamine_cell(v) for v in r] for r in ws.to_python(skip_empty_area=False)]
+        while rows and all(v is None for v in rows[-1]):
+            rows.pop()  # 末尾の空行は落とす
+        header, data = (rows[0], rows[1:]) if rows else ([], [])
+
+        # 列数は見出しとデータを合わせた使用範囲まで（見出しが空でもデータがある列は残す）
+        width = max((_used_width(r) for r in rows), default=0)
+        header = header[:width] + [None] * (width - len(header))
+        columns = _dedup_column_names([f"Unnamed: {i}" if c is None else c for i, c in enumerate(header)])
+
+        data = [tuple(r[:width]) + (None,) * (width - len(r)) for r in data]
+        return pd.DataFrame(data, columns=columns)
+    finally:
+        wb.close()
 
 
 def _clean_columns(df: pd.DataFrame) -> pd.DataFrame:
-    df = df.copy()
-    df.columns = [str(c).strip().replace("　", " ") for c in df.columns]
-    return df
+    # copy() で全データを複製せず、列名だけ差し替えた新しいフレームを返す（呼び出し元は変更しない）
+    return df.set_axis([str(c).strip().replace("　", " ") for c in df.columns], axis=1)
 
 
 def _normalize_common_columns(df: pd.DataFrame) -> pd.DataFrame:
     df = _clean_columns(df)
 
-    rename_map = {}
-    for c in df.columns:
-        c2 = str(c).strip()
-        if c2 in ["エージェントID", "エージェントId", "agent_id", "AgentID", "AGENT_ID", "ID"]:
-            rename_map[c] = "agent_id"
-
+    rename_map = {c: "agent_id" for c in df.columns if str(c).strip() in AGENT_ID_ALIASES}
     df = df.rename(columns=rename_map)
 
     missing = [c for c in BASE_COLS if c not in df.columns]
@@ -156,16 +374,38 @@ def _normalize_common_columns(df: pd.DataFrame) -> pd.DataFrame:
         raise ValueError(f"Missing base columns: {missing}. found={list(df.columns)}")
 
     df["agent_id"] = df["agent_id"].astype(str).str.strip()
+    # 日付（文字列で来る場合）の前後空白もここで1回だけ落とし、下流（結合キー・要約の絞り込み）はそのまま比較する
+    # ※Excelの日付セルは値の型を変えない（出力シートで日付のまま書くため）
+    if pd.api.types.is_string_dtype(df["日付"]):
+        df["日付"] = df["日付"].str.strip()
     return df
 
 
+def _clean_numeric_strings(s: pd.Series) -> pd.Series:
+    x = s.astype(str).str.replace(NUMERIC_NOISE_PATTERN, "", regex=True)
+    return pd.to_numeric(x, errors="coerce").astype(float)
+
+
 def _to_numeric_series(s: pd.Series) -> pd.Series:
-    x = s.astype(str)
-    x = x.str.replace("%", "", regex=False).str.replace(",", "", regex=False).str.strip()
-    return pd.to_numeric(x, errors="coerce")
+    # 既に数値列なら文字列を経由しない（read_only 読み込みでは大半がこちら）
+    if s.dtype.kind in "iuf":
+        return s.astype(float)
+
+    if s.dtype != object:
+        return _clean_numeric_strings(s)
+
+    # 数値セルと文字列セルが混在する列：まずそのまま数値化し、失敗したセルだけ文字列を掃除する
+    # ※bool / 日付セルは従来どおり NaN
+    out = pd.to_numeric(s, errors="coerce").astype(float)
+    is_bool = s.map(type) == bool
+    out[is_bool] = np.nan
+    rest = out.isna() & s.notna() & ~is_bool
+    if rest.any():
+        out[rest] = _clean_numeric_strings(s[rest])
+    return out
 
 
-def _extract_metric_series(raw_df: pd.DataFrame, metric_name: str) -> pd.DataFrame:
+def _extract_metric_series(raw_df: pd.DataFrame, metric_name: str) -> pd.Series:
     df = _normalize_common_columns(raw_df)
     candidates = [c for c in df.columns if c not in BASE_COLS]
 
@@ -179,18 +419,50 @@ def _extract_metric_series(raw_df: pd.DataFrame, metric_name: str) -> pd.DataFra
             )
         metric_col = candidates[0]
 
-    out = df[["日付", "agent_id", metric_col]].copy()
-    out = out.rename(columns={metric_col: metric_name})
-    out[metric_name] = _to_numeric_series(out[metric_name])
+    # 中間フレームを copy() せず、キー列から直接インデックス付きの Series を組み立てる
+    out = pd.Series(
+        _to_numeric_series(df[metric_col]).to_numpy(),
+        index=pd.MultiIndex.from_arrays([df["日付"], df["agent_id"]]),
+        name=metric_name,
+    )
 
-    dup = out.duplicated(subset=["日付", "agent_id"], keep=False)
-    if dup.any():
-        sample = out.loc[dup, ["日付", "agent_id"]].head(5).to_dict(orient="records")
+    # 一意性はインデックス側で判定（結合でも同じインデックスを使うので追加の走査がほぼ無い）
+    # 重複サンプルの作成は失敗時だけ
+    if not out.index.is_unique:
+        dup = out.index.duplicated(keep=False)
+        sample = out.index[dup][:5].to_frame(index=False).to_dict(orient="records")
         raise ValueError(f"Duplicate keys in metric={metric_name} on (日付,agent_id). sample={sample}")
 
     return out
 
 
+def _join_key_kind(level: pd.Index) -> Optional[str]:
+    # merge と同じく「日付型 / 数値 / 文字列」の食い違いだけを見る（判定できない混在は通す）
+    if level.dtype.kind in "mM":
+        return "datetime"
+    if pd.api.types.is_numeric_dtype(level.dtype) or pd.api.types.is_bool_dtype(level.dtype):
+        return "numeric"
+    inferred = pd.api.types.infer_dtype(level, skipna=True)
+    if inferred in ("datetime", "datetime64", "date"):
+        return "datetime"
+    if inferred in ("integer", "floating", "mixed-integer-float", "decimal", "boolean"):
+        return "numeric"
+    if inferred == "string":
+        return "string"
+    return None
+
+
+def _check_join_key_dtypes(base_index: pd.MultiIndex, metric_index: pd.MultiIndex, metric_name: str) -> None:
+    # join はキーの型が違っても黙って全行NaNにするので、merge(validate=...) と同じくここで弾く
+    for key, left, right in zip(base_index.names, base_index.levels, metric_index.levels):
+        left_kind, right_kind = _join_key_kind(left), _join_key_kind(right)
+        if left_kind and right_kind and left_kind != right_kind:
+            raise ValueError(
+                f"You are trying to merge on {left.dtype} and {right.dtype} columns for key '{key}' "
+                f"(metric={metric_name})"
+            )
+
+
 def _build_fact_daily_and_long(
     raw_by_metric: Dict[str, pd.DataFrame],
     as_of_date: str,
@@ -199,27 +471,35 @@ def _build_fact_daily_and_long(
         raise ValueError("CPD.xlsx is required as base but not provided.")
 
     base = _normalize_common_columns(raw_by_metric["CPD"])
-    fact_daily = base[BASE_COLS].copy()
+    base = base[BASE_COLS].set_index(["日付", "agent_id"])
 
     metric_names = list(raw_by_metric.keys())
 
-    for metric in metric_names:
-        metric_df = _extract_metric_series(raw_by_metric[metric], metric)
-        fact_daily = fact_daily.merge(
-            metric_df,
-            on=["日付", "agent_id"],
-            how="left",
-            validate="one_to_one",
-        )
-
-    fact_long = fact_daily.melt(
-        id_vars=BASE_COLS,
-        value_vars=metric_names,
-        var_name="metric",
-        value_name="actual",
+    # 指標ごとに merge を繰り返すと毎回フレーム全体をコピーするので、
+    # (日付, agent_id) をインデックスに揃えて1回の concat + join で横持ちにする
+    # ※キー重複は _extract_metric_series 側で弾いている
+    metric_series = [_extract_metric_series(raw_by_metric[metric], metric) for metric in metric_names]
+    for series in metric_series:
+        _check_join_key_dtypes(base.index, series.index, series.name)
+    fact_daily = base.join(pd.concat(metric_series, axis=1), how="left").reset_index()
+
+    # agent_id / metric は Fact_Long で指標数ぶん繰り返すので category で持つ
+    # （結合キーは MultiIndex 側で既に整数コード化されるため、変換は結合後に1回だけ）
+    fact_daily["agent_id"] = fact_daily["agent_id"].astype("category")
+
+    # melt 相当（指標ごとに全行を縦に積む）を配列から直接組み立てる
+    # work_flag は行×指標ぶん計算せず、日次の行で1回だけ出して並べる
+    n = len(fact_daily)
+    m = len(metric_names)
+    work_flag = (fact_daily["勤務区分"].astype(str).str.strip() != "休み").astype(int).to_numpy()
+
+    fact_long = fact_daily[BASE_COLS].take(np.tile(np.arange(n), m)).reset_index(drop=True)
+    fact_long = fact_long.assign(
+        metric=pd.Categorical.from_codes(np.repeat(np.arange(m), n), categories=metric_names),
+        actual=np.concatenate([fact_daily[metric].to_numpy() for metric in metric_names]),
+        as_of_date=as_of_date,
+        work_flag=np.tile(work_flag, m),
     )
-    fact_long["as_of_date"] = as_of_date
-    fact_long["work_flag"] = (fact_long["勤務区分"].astype(str).str.strip() != "休み").astype(int)
 
     return fact_daily, fact_long
 
@@ -228,27 +508,50 @@ def _build_fact_daily_and_long(
 # openpyxl（テンプレに書き込み）
 # ----------------------------
 def _clear_worksheet(ws):
-    mr = ws.max_row
-    mc = ws.max_column
-    if mr < 1 or mc < 1:
-        return
-    for r in range(1, mr + 1):
-        for c in range(1, mc + 1):
-            ws.cell(row=r, column=c).value = None
+    # セル自体は消さず値だけ空にする（テンプレの書式はセルに付いているので残す）
+    # 使用範囲を iter_rows で総なめせず、実在するセルのうち値が入っているものだけ触る
+    for cell in ws._cells.values():
+        if cell.value is not None:
+            cell.value = None
 
 
 def _write_df_to_sheet(ws, df: pd.DataFrame):
-    cols = list(df.columns)
-    for c, name in enumerate(cols, start=1):
-        ws.cell(row=1, column=c).value = name
-
-    values = df.where(pd.notnull(df), None).values.tolist()
-    for r_idx, row in enumerate(values, start=2):
+    # ws.cell() はセルごとのオーバーヘッドが大きいので、セル辞書に直接書く
+    # テンプレに既にあるセルは値だけ上書きし（見出しの太字・列の表示形式などを残す）、無いセルだけ作る
+    # ※先に _clear_worksheet で値を空にしておく前提なので、空セル（None/NaN）は書かない
+    cells = ws._cells
+
+    for c_idx, name in enumerate(df.columns, start=1):
+        cell = cells.get((1, c_idx))
+        if cell is None:
+            cells[(1, c_idx)] = Cell(ws, row=1, column=c_idx, value=name)
+        else:
+            cell.value = name
+
+    # where()/values でフレーム丸ごとの中間配列を作らず、1行ずつ NaN（v != v）を飛ばす
+    for r_idx, row in enumerate(df.itertuples(index=False, name=None), start=2):
         for c_idx, v in enumerate(row, start=1):
-            ws.cell(row=r_idx, column=c_idx).value = v
+            if v is None or v != v:
+                continue
+            cell = cells.get((r_idx, c_idx))
+            if cell is None:
+                cells[(r_idx, c_idx)] = Cell(ws, row=r_idx, column=c_idx, value=v)
+            else:
+                cell.value = v
+
+
+def _save_workbook(wb) -> BytesIO:
+    # wb.save() は zlib 既定（6）で圧縮するので、同じ書き出しを圧縮レベルだけ下げた ZipFile で行う
+    # （添付して1回送るだけなので、圧縮率より速度を取る）
+    out = BytesIO()
+    archive = zipfile.ZipFile(out, "w", zipfile.ZIP_DEFLATED, allowZip64=True, compresslevel=OUTPUT_ZIP_COMPRESSLEVEL)
+    ExcelWriter(wb, archive).save()
+    # getvalue() でバイト列を丸ごと複製せず、バッファのまま渡す
+    out.seek(0)
+    return out
 
 
-def _build_output_excel_bytes(template_bytes: bytes, fact_daily: pd.DataFrame, fact_long: pd.DataFrame) -> bytes:
+def _build_output_excel(template_bytes: bytes, fact_daily: pd.DataFrame, fact_long: pd.DataFrame) -> BytesIO:
     wb = load_workbook(BytesIO(template_bytes))
 
     if SHEET_FACT_DAILY not in wb.sheetnames:
@@ -265,18 +568,63 @@ def _build_output_excel_bytes(template_bytes: bytes, fact_daily: pd.DataFrame, f
     _clear_worksheet(ws_long)
     _write_df_to_sheet(ws_long, fact_long)
 
-    out = BytesIO()
-    wb.save(out)
-    return out.getvalue()
+    return _save_workbook(wb)
 
 
 # ----------------------------
 # Mail（Mailtrap含む SMTP 添付送信）
 # ----------------------------
+# STARTTLS＋LOGIN は毎回だと数往復かかるので、接続をプロセス内で持ち回る
+# （key -> (smtplib.SMTP, 最終使用時刻 time.monotonic)、_SMTP_LOCK の中でだけ触る）
+_SMTP_HOLDER: Dict[Tuple[str, int, str, str], Tuple[smtplib.SMTP, float]] = {}
+_SMTP_LOCK = threading.Lock()
+
+SMTP_TIMEOUT_SECONDS = 30
+# これより長く使っていない接続は、NAT/LB に黙って切られている前提で NOOP せずに張り直す
+SMTP_IDLE_RECONNECT_SECONDS = 60
+# 生存確認（NOOP）だけは短いタイムアウトで待つ
+SMTP_NOOP_TIMEOUT_SECONDS = 5
+
+
+def _smtp_is_alive(s: smtplib.SMTP) -> bool:
+    try:
+        s.sock.settimeout(SMTP_NOOP_TIMEOUT_SECONDS)
+        alive = s.noop()[0] == 250
+        s.sock.settimeout(SMTP_TIMEOUT_SECONDS)
+        return alive
+    except (OSError, AttributeError):  # smtplib.SMTPException も OSError の派生。sock が無ければ AttributeError
+        return False
+
+
+def _get_smtp_connection(smtp_host: str, smtp_port: int, smtp_user: str, smtp_pass: str) -> smtplib.SMTP:
+    key = (smtp_host, smtp_port, smtp_user, smtp_pass)
+    cached = _SMTP_HOLDER.get(key)
+    if cached is not None:
+        s, last_used = cached
+        if time.monotonic() - last_used <= SMTP_IDLE_RECONNECT_SECONDS and _smtp_is_alive(s):
+            return s
+
+    # 切れた接続・長く放置した接続・設定が変わった古い接続は閉じてから張り直す
+    for stale, _ in _SMTP_HOLDER.values():
+        stale.close()
+    _SMTP_HOLDER.clear()
+    s = smtplib.SMTP(smtp_host, smtp_port, timeout=SMTP_TIMEOUT_SECONDS)
+    try:
+        s.ehlo()
+        s.starttls()
+        s.ehlo()
+        s.login(smtp_user, smtp_pass)
+    except Exception:
+        s.close()
+        raise
+    _SMTP_HOLDER[key] = (s, time.monotonic())
+    return s
+
+
 def _send_mail_with_attachment(
     subject: str,
     body: str,
-    attachment_bytes: bytes,
+    attachment: BytesIO,
     attachment_filename: str,
 ):
     smtp_host = os.environ.get("SMTP_HOST")
@@ -307,25 +655,154 @@ def _send_mail_with_attachment(
     msg.set_content(body)
 
     msg.add_attachment(
-        attachment_bytes,
+        attachment.getbuffer(),  # コピーせずバッファのビューを渡す
         maintype="application",
         subtype="vnd.openxmlformats-officedocument.spreadsheetml.sheet",
         filename=attachment_filename,
     )
 
-    with smtplib.SMTP(smtp_host, smtp_port, timeout=30) as s:
-        s.ehlo()
-        s.starttls()
-        s.ehlo()
-        s.login(smtp_user, smtp_pass)
-        s.send_message(msg)
+    # 接続は使い回す（別日付の実行と同時に送らないようロックで直列化）
+    with _SMTP_LOCK:
+        s = _get_smtp_connection(smtp_host, smtp_port, smtp_user, smtp_pass)
+        try:
+            s.send_message(msg)
+        except Exception:
+            # 送信途中で失敗した接続は状態が読めないので捨てる（再送はしない）
+            _SMTP_HOLDER.clear()
+            s.close()
+            raise
+        _SMTP_HOLDER[(smtp_host, smtp_port, smtp_user, smtp_pass)] = (s, time.monotonic())
 
 
 # ----------------------------
 # Main Endpoint
 # ----------------------------
+def _run_daily_close_job(input_folder_id: str, template_file_id: str, as_of_date: str, run_id: str) -> Dict[str, Any]:
+    # Drive/SMTP はどれも同期I/Oなので、この関数ごとワーカースレッドで実行する
+    # （Drive service はこのスレッド内だけで使う）
+    jst = ZoneInfo("Asia/Tokyo")
+
+    drive = _get_drive_service()
+
+    # Phase1: 前日フォルダ取得（テンプレの更新日時も同じ往復で取っておく）
+    batch_results = _execute_batch(drive, {
+        "daily_folder": _find_child_folder_request(drive, input_folder_id, as_of_date),
+        "template_meta": drive.files().get(fileId=template_file_id, fields="modifiedTime"),
+    })
+
+    folder_res, folder_err = batch_results["daily_folder"]
+    if folder_err is not None:
+        raise folder_err
+    folders = folder_res.get("files", [])
+    daily_folder = folders[0] if folders else None
+
+    # テンプレ側の失敗は Phase3 のダウンロードで改めて表面化させる
+    template_meta, _ = batch_results["template_meta"]
+    template_modified_time = (template_meta or {}).get("modifiedTime")
+
+    if not daily_folder:
+        return {
+            "result": "input_not_ready",
+            "phase": "phase1_find_folder",
+            "as_of_date": as_of_date,
+            "run_id": run_id,
+            "detail": f"Daily folder not found: {as_of_date}",
+        }
+
+    daily_folder_id = daily_folder["id"]
+    required_files = _list_required_files(drive, daily_folder_id)
+
+    file_id_by_name = {f["name"]: f["id"] for f in required_files}
+    missing_files = [name for name in REQUIRED_FILES if name not in file_id_by_name]
+
+    if missing_files:
+        # 不足時だけフォルダ全体を取り直し、何が置かれているかを返す
+        children = _list_child_files(drive, daily_folder_id, page_size=200)
+        found_file_names = sorted(
+            [
+                f["name"]
+                for f in children
+                if f.get("mimeType") != "application/vnd.google-apps.folder"
+            ]
+        )
+        return {
+            "result": "input_not_ready",
+            "phase": "phase1_validate_inputs",
+            "as_of_date": as_of_date,
+            "run_id": run_id,
+            "missing_files": missing_files,
+            "found_files": found_file_names,
+        }
+
+    # Phase2: Data読み込み
+    input_cache_key = _input_cache_key(daily_folder_id, required_files)
+    raw_by_metric = _get_cached_input_frames(input_cache_key)
+    if raw_by_metric is None:
+        df_by_name = _load_input_frames_concurrently(file_id_by_name, sheet_name="Data")
+        raw_by_metric = {
+            metric: df_by_name[filename] for filename, metric in REQUIRED_ITEMS
+        }
+        _put_cached_input_frames(input_cache_key, raw_by_metric)
+
+    fact_daily, fact_long = _build_fact_daily_and_long(raw_by_metric, as_of_date)
+
+    # Phase3: テンプレ取得 -> Excel生成
+    # 要約は Excel 生成と独立なので、テンプレ取得（I/O待ち）の間に並行して作っておく
+    with ThreadPoolExecutor(max_workers=1) as summary_executor:
+        summary_future = summary_executor.submit(generate_summary, fact_daily, as_of_date)
+
+        template_bytes = _get_template_bytes(drive, template_file_id, template_modified_time)
+        output_excel = _build_output_excel(template_bytes, fact_daily, fact_long)
+
+        # 要約生成（落ちても送信は止めない）
+        try:
+            summary = summary_future.result()
+        except Exception as e:
+            summary = f"要約生成に失敗しました: {type(e).__name__}: {e}"
+
+    # メール送信（添付）
+    attach_name = f"{as_of_date}_前日確定版_実績.xlsx"
+    subject = f"[前日確定版] {as_of_date} 実績レポート"
+
+    body = (
+        f"{as_of_date} の前日確定版レポートを生成しました。\n"
+        f"添付ファイルをご確認ください。\n\n"
+        f"▼ 5行要約\n"
+        f"{summary}\n"
+    )
+
+    _send_mail_with_attachment(
+        subject=subject,
+        body=body,
+        attachment=output_excel,
+        attachment_filename=attach_name,
+    )
+
+    # 送信済みの日付は台帳で弾かれて再実行されないので、入力キャッシュもここで手放す
+    _drop_cached_input_frames(input_cache_key)
+
+    # 成功を簡易台帳に保存（練習用）
+    RUN_SUCCESS[as_of_date] = {
+        "run_id": run_id,
+        "finished_at": datetime.now(jst).isoformat(),
+        "fact_daily_rows": int(len(fact_daily)),
+        "fact_long_rows": int(len(fact_long)),
+        "attachment_filename": attach_name,
+    }
+
+    return {
+        "result": "success",
+        "phase": "phase3_mail_sent",
+        "as_of_date": as_of_date,
+        "run_id": run_id,
+        "fact_daily_rows": int(len(fact_daily)),
+        "fact_long_rows": int(len(fact_long)),
+        "attachment_filename": attach_name,
+    }
+
+
 @app.post("/run_daily_close")
-def run_daily_close(
+async def run_daily_close(
     target_date: Optional[str] = Query(default=None, description="YYYY-MM-DD. default = yesterday(JST)")
 ):
     input_folder_id = os.environ.get("DRIVE_INPUT_FOLDER_ID")
@@ -354,14 +831,13 @@ def run_daily_close(
             "message": "Already sent for this date (memory ledger).",
         }
 
-    # ロックTTL掃除
-    now = datetime.now(jst)
-    expired_keys = []
-    for k, t in RUN_LOCK.items():
-        if (now - t).total_seconds() > LOCK_TTL_SECONDS:
-            expired_keys.append(k)
-    for k in expired_keys:
-        RUN_LOCK.pop(k, None)
+    # ロックTTL掃除（期限の早い順に heap から取り出し、期限切れの分だけ見る）
+    now = time.monotonic()
+    while RUN_LOCK_EXPIRY and RUN_LOCK_EXPIRY[0][0] <= now:
+        _, k, acquired = heapq.heappop(RUN_LOCK_EXPIRY)
+        # 解放後に取り直されたロックは別物なので残す
+        if RUN_LOCK.get(k) == acquired:
+            RUN_LOCK.pop(k, None)
 
     # 実行中ロック
     if as_of_date in RUN_LOCK:
@@ -371,112 +847,16 @@ def run_daily_close(
             "message": "Job is already running (memory lock).",
         }
 
-    # ロック取得
+    # ロック取得（ここまで await を挟まないので、確認と取得はイベントループ上で不可分）
     RUN_LOCK[as_of_date] = now
+    heapq.heappush(RUN_LOCK_EXPIRY, (now + LOCK_TTL_SECONDS, as_of_date, now))
     run_id = str(uuid.uuid4())
 
     try:
-        drive = _get_drive_service()
-
-        # Phase1: 前日フォルダ取得
-        daily_folder = _find_child_folder_by_name(drive, input_folder_id, as_of_date)
-        if not daily_folder:
-            return {
-                "result": "input_not_ready",
-                "phase": "phase1_find_folder",
-                "as_of_date": as_of_date,
-                "run_id": run_id,
-                "detail": f"Daily folder not found: {as_of_date}",
-            }
-
-        daily_folder_id = daily_folder["id"]
-        children = _list_child_files(drive, daily_folder_id, page_size=200)
-
-        found_file_names = sorted(
-            [
-                f["name"]
-                for f in children
-                if f.get("mimeType") != "application/vnd.google-apps.folder"
-            ]
+        return await asyncio.to_thread(
+            _run_daily_close_job, input_folder_id, template_file_id, as_of_date, run_id
         )
 
-        found_set = set(found_file_names)
-        missing_files = [name for name in REQUIRED_FILES if name not in found_set]
-
-        if missing_files:
-            return {
-                "result": "input_not_ready",
-                "phase": "phase1_validate_inputs",
-                "as_of_date": as_of_date,
-                "run_id": run_id,
-                "missing_files": missing_files,
-                "found_files": found_file_names,
-            }
-
-        # Phase2: Data読み込み
-        file_id_by_name = {
-            f["name"]: f["id"]
-            for f in children
-            if f.get("mimeType") != "application/vnd.google-apps.folder"
-        }
-
-        raw_by_metric: Dict[str, pd.DataFrame] = {}
-        for filename in REQUIRED_FILES:
-            metric = METRIC_BY_FILENAME[filename]
-            file_id = file_id_by_name[filename]
-            xbytes = _download_file_bytes(drive, file_id)
-            df = _read_excel_from_bytes(xbytes, sheet_name="Data")
-            raw_by_metric[metric] = df
-
-        fact_daily, fact_long = _build_fact_daily_and_long(raw_by_metric, as_of_date)
-
-        # Phase3: テンプレ取得 -> Excel生成
-        template_bytes = _download_file_bytes(drive, template_file_id)
-        output_excel_bytes = _build_output_excel_bytes(template_bytes, fact_daily, fact_long)
-
-        # 要約生成（落ちても送信は止めない）
-        try:
-            summary = generate_summary(fact_daily, as_of_date)
-        except Exception as e:
-            summary = f"要約生成に失敗しました: {type(e).__name__}: {e}"
-
-        # メール送信（添付）
-        attach_name = f"{as_of_date}_前日確定版_実績.xlsx"
-        subject = f"[前日確定版] {as_of_date} 実績レポート"
-
-        body = (
-            f"{as_of_date} の前日確定版レポートを生成しました。\n"
-            f"添付ファイルをご確認ください。\n\n"
-            f"▼ 5行要約\n"
-            f"{summary}\n"
-        )
-
-        _send_mail_with_attachment(
-            subject=subject,
-            body=body,
-            attachment_bytes=output_excel_bytes,
-            attachment_filename=attach_name,
-        )
-
-        # 成功を簡易台帳に保存（練習用）
-        RUN_SUCCESS[as_of_date] = {
-            "run_id": run_id,
-            "finished_at": datetime.now(jst).isoformat(),
-            "fact_daily_rows": int(len(fact_daily)),
-            "fact_long_rows": int(len(fact_long)),
-            "attachment_filename": attach_name,
-        }
-
-        return {
-            "result": "success",
-            "phase": "phase3_mail_sent",
-            "as_of_date": as_of_date,
-            "run_id": run_id,
-            "fact_daily_rows": int(len(fact_daily)),
-            "fact_long_rows": int(len(fact_long)),
-            "attachment_filename": attach_name,
-        }
-
     except Exception as e:
         return JSONResponse(
             status_code=200,
@@ -490,4 +870,6 @@ def run_daily_close(
         )
 
     finally:
-        RUN_LOCK.pop(as_of_date, None)
+        # TTL切れ後に別の実行が取り直したロックは外さない
+        if RUN_LOCK.get(as_of_date) == now:
+            RUN_LOCK.pop(as_of_date, None)
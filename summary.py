@@ -49,14 +49,15 @@ def generate_summary(fact_daily: pd.DataFrame, as_of_date: str) -> str:
     if fact_daily is None or fact_daily.empty:
         return "データがありません。"
 
-    df = fact_daily.copy()
-
     # 前日分だけに絞る
-    if "日付" not in df.columns:
+    # ※Excel生成と並行して呼ばれるので、fact_daily には列を足さず、コピーもしない
+    if "日付" not in fact_daily.columns:
         return "要約生成不可：列不足 ['日付']"
-    df["日付"] = df["日付"].astype(str).str.strip()
     target_date = str(as_of_date).strip()
-    df = df[df["日付"] == target_date]
+    dates = fact_daily["日付"]
+    if not pd.api.types.is_string_dtype(dates):
+        dates = dates.astype(str).str.strip()  # 文字列の日付は main 側で前後空白を落とし済み
+    df = fact_daily[dates == target_date]
 
     if df.empty:
         return f"{target_date} のデータが見つかりません（日付フィルタ後0件）"
@@ -69,17 +70,17 @@ def generate_summary(fact_daily: pd.DataFrame, as_of_date: str) -> str:
         cpd_line1 = "1) 受電実績：CPD（列不足で集計不可）"
         cpd_line2 = "2) CPD未達（人数）：（列不足で集計不可）"
     else:
-        df["cpd_act"] = _to_num(df["CPD"])
-        df["cpd_tgt"] = _to_num(df["CPD目標"])
+        cpd_act = _to_num(df["CPD"])
+        cpd_tgt = _to_num(df["CPD目標"])
 
-        target_mask = df["cpd_tgt"].notna()
+        target_mask = cpd_tgt.notna()
         target_n = int(target_mask.sum())
 
-        cpd_act_sum = float(df.loc[target_mask, "cpd_act"].sum(skipna=True))
-        cpd_plan_sum = float(df.loc[target_mask, "cpd_tgt"].sum(skipna=True))
+        cpd_act_sum = float(cpd_act[target_mask].sum(skipna=True))
+        cpd_plan_sum = float(cpd_tgt[target_mask].sum(skipna=True))
         cpd_rate = (cpd_act_sum / cpd_plan_sum) if cpd_plan_sum else np.nan
 
-        hit_mask = target_mask & (df["cpd_act"] >= df["cpd_tgt"])
+        hit_mask = target_mask & (cpd_act >= cpd_tgt)
         hit_n = int(hit_mask.sum())
         miss_n = int(target_n - hit_n)
         hit_rate = hit_n / target_n if target_n else np.nan
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# main.py / summary.py はリポジトリ直下のモジュールなので、そのまま import できるようにする
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,38 @@
+import pandas as pd
+import pytest
+
+import main
+
+
+def _raw(metric: str, dates) -> pd.DataFrame:
+    return pd.DataFrame(
+        {
+            "日付": dates,
+            "agent_id": ["A001", "A002"],
+            "氏名": ["山田", "佐藤"],
+            "勤務区分": ["日勤", "休み"],
+            "実働時間(h)": [8, 0],
+            "CPD目標": [30.0, None],
+            metric: ["1,080", "12%"],
+        }
+    )
+
+
+def test_metrics_are_joined_on_date_and_agent():
+    dates = ["2026-02-20", "2026-02-20"]
+    raw = {"CPD": _raw("CPD", dates), "AHT": _raw("AHT", dates)}
+
+    fact_daily, fact_long = main._build_fact_daily_and_long(raw, "2026-02-20")
+
+    assert fact_daily["CPD"].tolist() == [1080.0, 12.0]
+    assert fact_daily["AHT"].tolist() == [1080.0, 12.0]
+    assert len(fact_long) == 4
+    assert fact_long["work_flag"].tolist() == [1, 0, 1, 0]
+
+
+def test_mismatched_date_key_types_raise_instead_of_joining_to_nan():
+    dates = ["2026-02-20", "2026-02-20"]
+    raw = {"CPD": _raw("CPD", dates), "AHT": _raw("AHT", pd.to_datetime(dates))}
+
+    with pytest.raises(ValueError, match="for key '日付'"):
+        main._build_fact_daily_and_long(raw, "2026-02-20")
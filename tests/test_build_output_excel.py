@@ -0,0 +1,114 @@
+from io import BytesIO
+
+import numpy as np
+import pandas as pd
+from openpyxl import Workbook, load_workbook
+from openpyxl.styles import Font, PatternFill
+
+import main
+
+
+def _make_template(styled: bool = False) -> bytes:
+    wb = Workbook()
+    summary = wb.active
+    summary.title = "Summary"
+    summary["A1"] = "集計"
+
+    for name in (main.SHEET_FACT_DAILY, main.SHEET_FACT_LONG):
+        ws = wb.create_sheet(name)
+        ws.column_dimensions["B"].width = 24
+        # 前回分の古い値（出力より行数が多い）
+        for r in range(1, 10):
+            for c in range(1, 5):
+                ws.cell(row=r, column=c, value=f"old{r}-{c}")
+        if styled:
+            for c in range(1, 5):
+                cell = ws.cell(row=1, column=c)
+                cell.font = Font(bold=True)
+                cell.fill = PatternFill("solid", fgColor="FFFF00")
+            for r in range(2, 10):
+                ws.cell(row=r, column=3).number_format = "0.0%"
+
+    out = BytesIO()
+    wb.save(out)
+    return out.getvalue()
+
+
+def _fact_frames():
+    fact_daily = pd.DataFrame(
+        {
+            "日付": ["2026-02-20", "2026-02-20", "2026-02-20"],
+            "agent_id": pd.Categorical([" A001 ", "A002", "A<&>\"003"]),
+            "rate": [0.25, np.nan, 1.5],
+            "実働時間(h)": [8, 7, 0],
+        }
+    )
+    fact_long = pd.DataFrame(
+        {
+            "agent_id": pd.Categorical(["A001", "A001"]),
+            "metric": pd.Categorical(["CPH", "AHT"]),
+            "actual": [4.5, np.nan],
+        }
+    )
+    return fact_daily, fact_long
+
+
+def _sheet_values(ws):
+    return [list(r) for r in ws.iter_rows(values_only=True)]
+
+
+def _expected_values(df: pd.DataFrame):
+    rows = [list(df.columns)]
+    for row in df.astype(object).itertuples(index=False, name=None):
+        rows.append([None if v != v else v for v in row])
+    return rows
+
+
+def test_values_round_trip_and_other_sheets_are_kept():
+    fact_daily, fact_long = _fact_frames()
+    out = main._build_output_excel(_make_template(), fact_daily, fact_long)
+
+    wb = load_workbook(out)
+    assert wb.sheetnames == ["Summary", main.SHEET_FACT_DAILY, main.SHEET_FACT_LONG]
+    assert wb["Summary"]["A1"].value == "集計"
+    assert wb[main.SHEET_FACT_DAILY].column_dimensions["B"].width == 24
+
+    expected = _expected_values(fact_daily)
+    values = _sheet_values(wb[main.SHEET_FACT_DAILY])
+    assert values[: len(expected)] == expected
+    # 前回分の古い値は残らない
+    assert all(v is None for row in values[len(expected):] for v in row)
+
+    expected = _expected_values(fact_long)
+    values = [row[: len(fact_long.columns)] for row in _sheet_values(wb[main.SHEET_FACT_LONG])]
+    assert values[: len(expected)] == expected
+    assert all(v is None for row in _sheet_values(wb[main.SHEET_FACT_LONG])[len(expected):] for v in row)
+
+
+def test_styled_template_keeps_header_and_column_formats():
+    fact_daily, fact_long = _fact_frames()
+    out = main._build_output_excel(_make_template(styled=True), fact_daily, fact_long)
+
+    wb = load_workbook(out)
+    ws = wb[main.SHEET_FACT_DAILY]
+
+    values = _sheet_values(ws)
+    expected = _expected_values(fact_daily)
+    assert values[: len(expected)] == expected
+    # 古い値は残らない（テンプレのセル自体は書式ごと残る）
+    assert all(v is None for row in values[len(expected):] for v in row)
+
+    assert ws["A1"].font.b is True
+    assert ws["A1"].fill.fgColor.rgb == "00FFFF00"
+    assert ws["C2"].number_format == "0.0%"
+
+
+def test_datetime_values_are_written_as_dates_on_a_styled_template():
+    fact_daily, fact_long = _fact_frames()
+    fact_daily["日付"] = pd.to_datetime(fact_daily["日付"])
+    out = main._build_output_excel(_make_template(styled=True), fact_daily, fact_long)
+
+    ws = load_workbook(out)[main.SHEET_FACT_DAILY]
+    assert ws["A2"].value == pd.Timestamp("2026-02-20").to_pydatetime()
+    assert ws["A2"].is_date
+    assert ws["A1"].font.b is True
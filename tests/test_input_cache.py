@@ -0,0 +1,64 @@
+import threading
+
+import pytest
+
+import main
+
+
+@pytest.fixture(autouse=True)
+def _empty_cache():
+    main.INPUT_CACHE.clear()
+    yield
+    main.INPUT_CACHE.clear()
+
+
+def _key(i: int):
+    return (f"folder{i}", (("CPD.xlsx", f"id{i}", "2026-02-20T00:00:00Z"),))
+
+
+def test_entries_expire_on_the_monotonic_clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(main.time, "monotonic", lambda: now[0])
+
+    main._put_cached_input_frames(_key(0), {"CPD": "frames"})
+    assert main._get_cached_input_frames(_key(0)) == {"CPD": "frames"}
+
+    now[0] += main.INPUT_CACHE_TTL_SECONDS + 1
+    # 期限切れは書き込み時にも掃除される
+    main._put_cached_input_frames(_key(1), {"CPD": "frames"})
+    assert list(main.INPUT_CACHE) == [_key(1)]
+
+
+def test_cache_size_is_capped_dropping_the_oldest(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(main.time, "monotonic", lambda: now[0])
+
+    for i in range(main.INPUT_CACHE_MAX_ENTRIES + 2):
+        now[0] += 1
+        main._put_cached_input_frames(_key(i), {"CPD": i})
+
+    assert len(main.INPUT_CACHE) == main.INPUT_CACHE_MAX_ENTRIES
+    assert _key(0) not in main.INPUT_CACHE and _key(1) not in main.INPUT_CACHE
+
+
+def test_concurrent_jobs_can_share_the_cache():
+    errors = []
+
+    def _worker(i: int):
+        try:
+            for j in range(2000):
+                key = _key((i * 7 + j) % 10)
+                main._put_cached_input_frames(key, {"CPD": j})
+                main._get_cached_input_frames(key)
+                main._drop_cached_input_frames(key)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=_worker, args=(i,)) for i in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert errors == []
+    assert len(main.INPUT_CACHE) <= main.INPUT_CACHE_MAX_ENTRIES
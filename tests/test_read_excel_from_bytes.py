@@ -0,0 +1,67 @@
+from io import BytesIO
+
+import pandas as pd
+from openpyxl import Workbook
+
+import main
+
+
+def _xlsx(rows, sheet_name: str = "Data") -> bytes:
+    wb = Workbook()
+    ws = wb.active
+    ws.title = sheet_name
+    for r_idx, row in enumerate(rows, start=1):
+        for c_idx, v in enumerate(row, start=1):
+            if v is not None:
+                ws.cell(row=r_idx, column=c_idx, value=v)
+    out = BytesIO()
+    wb.save(out)
+    return out.getvalue()
+
+
+def _base_row(agent_id: str):
+    return ["2026-02-20", agent_id, "山田", "日勤", 8, 30]
+
+
+def test_column_with_blank_header_is_kept_as_unnamed():
+    xbytes = _xlsx(
+        [
+            main.BASE_COLS + [None],
+            _base_row("A001") + [1.5],
+            _base_row("A002") + [2],
+        ]
+    )
+
+    df = main._read_excel_from_bytes(xbytes, sheet_name="Data")
+    assert list(df.columns) == main.BASE_COLS + ["Unnamed: 6"]
+
+    # 見出しなしの値列が唯一の候補として拾われる
+    series = main._extract_metric_series(df, "AHT")
+    assert series.tolist() == [1.5, 2.0]
+
+
+def test_duplicate_headers_are_renamed_like_pandas():
+    rows = [["日付", "CPH", "CPH", "CPH.1", "x", "x"], ["2026-02-20", 1, 2, 3, 4, 5]]
+    xbytes = _xlsx(rows)
+
+    df = main._read_excel_from_bytes(xbytes, sheet_name="Data")
+    expected = pd.read_excel(BytesIO(xbytes), sheet_name="Data", engine="openpyxl")
+    assert list(df.columns) == list(expected.columns)
+
+
+def test_trailing_empty_rows_and_columns_are_dropped_and_sheet_falls_back():
+    xbytes = _xlsx([["a", "b", None], [1, None, None], [None, None, None]], sheet_name="Other")
+
+    df = main._read_excel_from_bytes(xbytes, sheet_name="Data")
+    assert list(df.columns) == ["a", "b"]
+    assert df.values.tolist() == [[1, None]]
+
+
+def test_leading_blank_rows_and_columns_are_kept_like_pandas():
+    # B2 始まりの表：pandas は先頭の空行を見出し、空列を Unnamed: 0 として残す
+    xbytes = _xlsx([[None, None, None], [None, "a", "b"], [None, 1, 2]])
+
+    df = main._read_excel_from_bytes(xbytes, sheet_name="Data")
+    expected = pd.read_excel(BytesIO(xbytes), sheet_name="Data", engine="openpyxl")
+    assert list(df.columns) == list(expected.columns) == ["Unnamed: 0", "Unnamed: 1", "Unnamed: 2"]
+    assert df.values.tolist() == [[None, "a", "b"], [None, 1, 2]]
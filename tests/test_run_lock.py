@@ -0,0 +1,80 @@
+import asyncio
+
+import pytest
+
+import main
+
+AS_OF_DATE = "2026-02-20"
+
+
+@pytest.fixture(autouse=True)
+def _env(monkeypatch):
+    monkeypatch.setenv("DRIVE_INPUT_FOLDER_ID", "input-folder")
+    monkeypatch.setenv("DRIVE_TEMPLATE_FILE_ID", "template")
+    main.RUN_LOCK.clear()
+    main.RUN_LOCK_EXPIRY.clear()
+    main.RUN_SUCCESS.clear()
+    yield
+    main.RUN_LOCK.clear()
+    main.RUN_LOCK_EXPIRY.clear()
+    main.RUN_SUCCESS.clear()
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(main.time, "monotonic", lambda: now[0])
+    return now
+
+
+def _run():
+    return asyncio.run(main.run_daily_close(target_date=AS_OF_DATE))
+
+
+def _job_result(monkeypatch):
+    def _job(input_folder_id, template_file_id, as_of_date, run_id):
+        return {"result": "success", "as_of_date": as_of_date, "run_id": run_id}
+
+    monkeypatch.setattr(main, "_run_daily_close_job", _job)
+
+
+def test_held_lock_reports_running(clock, monkeypatch):
+    _job_result(monkeypatch)
+    main.RUN_LOCK[AS_OF_DATE] = clock[0]
+    main.RUN_LOCK_EXPIRY.append((clock[0] + main.LOCK_TTL_SECONDS, AS_OF_DATE, clock[0]))
+
+    assert _run()["result"] == "running"
+
+
+def test_expired_lock_is_swept_and_the_job_runs(clock, monkeypatch):
+    _job_result(monkeypatch)
+    main.RUN_LOCK[AS_OF_DATE] = clock[0]
+    main.RUN_LOCK_EXPIRY.append((clock[0] + main.LOCK_TTL_SECONDS, AS_OF_DATE, clock[0]))
+    clock[0] += main.LOCK_TTL_SECONDS + 1
+
+    assert _run()["result"] == "success"
+    assert AS_OF_DATE not in main.RUN_LOCK
+
+
+def test_stale_heap_entry_does_not_evict_a_reacquired_lock(clock, monkeypatch):
+    _job_result(monkeypatch)
+    # 1回目のロック（期限切れ済み）の heap 項目が残ったまま、同じ日付で取り直されている
+    main.RUN_LOCK_EXPIRY.append((clock[0] + main.LOCK_TTL_SECONDS, AS_OF_DATE, clock[0]))
+    clock[0] += main.LOCK_TTL_SECONDS + 1
+    main.RUN_LOCK[AS_OF_DATE] = clock[0]
+    main.RUN_LOCK_EXPIRY.append((clock[0] + main.LOCK_TTL_SECONDS, AS_OF_DATE, clock[0]))
+
+    assert _run()["result"] == "running"
+    assert main.RUN_LOCK[AS_OF_DATE] == clock[0]
+
+
+def test_finished_run_keeps_a_lock_taken_by_a_newer_run(clock, monkeypatch):
+    def _job(input_folder_id, template_file_id, as_of_date, run_id):
+        # TTL 切れ後に別の実行が同じ日付のロックを取り直した状況
+        main.RUN_LOCK[as_of_date] = clock[0] + 1
+        return {"result": "success"}
+
+    monkeypatch.setattr(main, "_run_daily_close_job", _job)
+
+    assert _run()["result"] == "success"
+    assert main.RUN_LOCK[AS_OF_DATE] == clock[0] + 1
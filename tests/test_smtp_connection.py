@@ -0,0 +1,112 @@
+import smtplib
+from io import BytesIO
+
+import pytest
+
+import main
+
+
+class FakeSocket:
+    def __init__(self):
+        self.timeouts = []
+
+    def settimeout(self, value):
+        self.timeouts.append(value)
+
+
+class FakeSMTP:
+    instances = []
+
+    def __init__(self, host, port, timeout=None):
+        self.sock = FakeSocket()
+        self.alive = True
+        self.fail_send = False
+        self.sent = []
+        self.closed = False
+        FakeSMTP.instances.append(self)
+
+    def ehlo(self):
+        pass
+
+    def starttls(self):
+        pass
+
+    def login(self, user, password):
+        pass
+
+    def noop(self):
+        if not self.alive:
+            raise smtplib.SMTPServerDisconnected("gone")
+        return (250, b"OK")
+
+    def send_message(self, msg):
+        if self.fail_send:
+            raise smtplib.SMTPServerDisconnected("dropped mid-send")
+        self.sent.append(msg)
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture(autouse=True)
+def _fake_smtp(monkeypatch):
+    FakeSMTP.instances = []
+    main._SMTP_HOLDER.clear()
+    monkeypatch.setattr(main.smtplib, "SMTP", FakeSMTP)
+    for k, v in {"SMTP_HOST": "smtp.example", "SMTP_USER": "u", "SMTP_PASS": "p", "MAIL_TO": "a@example.com"}.items():
+        monkeypatch.setenv(k, v)
+    yield
+    main._SMTP_HOLDER.clear()
+
+
+def _send():
+    main._send_mail_with_attachment("subject", "body", BytesIO(b"xlsx"), "report.xlsx")
+
+
+def test_connection_is_reused_between_sends():
+    _send()
+    _send()
+
+    assert len(FakeSMTP.instances) == 1
+    assert len(FakeSMTP.instances[0].sent) == 2
+    # NOOP は短いタイムアウトで待ち、終わったら通常のタイムアウトに戻す
+    assert FakeSMTP.instances[0].sock.timeouts == [main.SMTP_NOOP_TIMEOUT_SECONDS, main.SMTP_TIMEOUT_SECONDS]
+
+
+def test_reconnects_when_noop_fails():
+    _send()
+    FakeSMTP.instances[0].alive = False
+    _send()
+
+    first, second = FakeSMTP.instances
+    assert first.closed and len(first.sent) == 1
+    assert len(second.sent) == 1
+
+
+def test_reconnects_without_noop_after_idle_limit(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(main.time, "monotonic", lambda: now[0])
+
+    _send()
+    now[0] += main.SMTP_IDLE_RECONNECT_SECONDS + 1
+    _send()
+
+    first, second = FakeSMTP.instances
+    assert first.closed
+    assert first.sock.timeouts == []  # 放置しすぎた接続には NOOP を打たない
+    assert len(second.sent) == 1
+
+
+def test_connection_is_discarded_after_send_failure_and_not_resent():
+    _send()
+    FakeSMTP.instances[0].fail_send = True
+    with pytest.raises(smtplib.SMTPServerDisconnected):
+        _send()
+
+    assert FakeSMTP.instances[0].closed
+    assert len(FakeSMTP.instances[0].sent) == 1
+    assert main._SMTP_HOLDER == {}
+
+    _send()
+    assert len(FakeSMTP.instances) == 2
+    assert len(FakeSMTP.instances[1].sent) == 1